@@ -474,7 +474,8 @@ def run_simulation(config: Dict, mode: str = 'explore') -> Dict[str, Any]:
             if config['control']['preemption_mode'] == 'sacrifice':
                 # 调用新的sacrifice可视化函数
                 try:
-                    plot_sacrifice_dynamics(exp_dir=output_dir, request_file=csv_path)
+                    # plot_queue_dynamics刚生成过该图，这里带request_file重新绘制，需要force跳过最新性检查
+                    plot_sacrifice_dynamics(exp_dir=output_dir, request_file=csv_path, force=True)
                     print("Sacrifice动态图表已生成")
                 except Exception as e:
                     print(f"生成Sacrifice图表失败: {e}")
@@ -51,6 +51,9 @@ class VLLMSimulatorWithTruncationAdmissionControl(VLLMSimulatorWithTruncation):
         # 保存原始的控制策略
         self.original_control_policy = control_policy
         
+        # 策略是否支持单独处理运行队列内存压力（初始化时检查一次，避免每步hasattr）
+        self._policy_has_memory_pressure = hasattr(self.control_policy, '_handle_running_memory_pressure')
+        
         if self.admission_enabled:
             print(f"准入控制已启用，阈值: {self.admission_threshold}")
     
@@ -94,7 +97,7 @@ class VLLMSimulatorWithTruncationAdmissionControl(VLLMSimulatorWithTruncation):
             是否继续仿真
         """
         # 检查是否有任何活动（所有队列都空才真正结束）
-        if not self.state.running and not self.state.waiting and not self.state.swapped:
+        if not (self.state.running or self.state.waiting or self.state.swapped):
             return False  # 仿真结束
         
         # 1. 如果没有运行中的批次，尝试构建新批次（带准入控制）
@@ -122,15 +125,15 @@ class VLLMSimulatorWithTruncationAdmissionControl(VLLMSimulatorWithTruncation):
                 # 允许准入，调用原有调度逻辑
                 self.control_policy.perform_scheduling_cycle(self.state, self.time)
             else:
-                # 拒绝准入，记录统计
+                # 拒绝准入，记录统计（有等待请求时无需再检查交换队列）
                 waiting_count = len(self.state.waiting)
-                swapped_count = len(self.state.swapped)
                 
-                if waiting_count > 0 or swapped_count > 0:
+                if waiting_count or self.state.swapped:
                     self.admission_rejected_count += 1
                     self.admission_rejected_batches.append(self.batch_id)
                     
                     if self.batch_id % 100 == 0 or self.config['experiment'].get('verbose', False):
+                        swapped_count = len(self.state.swapped)
                         memory_usage = self.state.gpu_memory_used
                         memory_total = self.state.M_total
                         memory_ratio = memory_usage / memory_total if memory_total > 0 else 0
@@ -142,7 +145,7 @@ class VLLMSimulatorWithTruncationAdmissionControl(VLLMSimulatorWithTruncation):
                 # 应该继续等待已有请求完成释放内存
             
             # 修改后的终止条件：只有当所有队列都空时才结束
-            if not self.state.running and not self.state.waiting and not self.state.swapped:
+            if not (self.state.running or self.state.waiting or self.state.swapped):
                 return False
         
         # 2. 从RUNNING列表中选择执行批次（受B约束）
@@ -180,7 +183,7 @@ class VLLMSimulatorWithTruncationAdmissionControl(VLLMSimulatorWithTruncation):
         else:
             # 即使不允许新准入，仍需要处理内存压力（如抢占）
             # 但不从WAITING准入新请求
-            if hasattr(self.control_policy, '_handle_running_memory_pressure'):
+            if self._policy_has_memory_pressure:
                 self.control_policy._handle_running_memory_pressure(self.state, self.time)
         
         # 重置批次sacrifice计数器
@@ -1,23 +1,424 @@
 #!/usr/bin/env python3
 """
 Visualization tool for experiment results
-Usage: python draw.py --csv /path/to/batch_snapshots.csv
+Usage: python draw.py --csv /path/to/batch_snapshots.csv [/path/to/other/batch_snapshots.csv ...]
 """
 
 import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 
+try:
+    import pyarrow  # noqa: F401  仅用于启用pandas的多线程CSV解析引擎
+    _CSV_ENGINE = 'pyarrow'
+except ImportError:
+    _CSV_ENGINE = 'c'
 
+try:
+    import datashader as ds
+    import datashader.transfer_functions as ds_tf
+except ImportError:
+    ds = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 按(子图行数, figsize)缓存的Figure：批量绘制多个实验时复用Figure和画布，避免反复创建
+# 默认关闭，设置环境变量DRAW_FIG_CACHE=1启用；缓存的Figure在各绘图函数间共享，不能用于多线程调用
+_FIG_CACHE = {}
+_FIG_CACHE_ENABLED = os.environ.get('DRAW_FIG_CACHE', '0') == '1'
+
+# 本模块绘图时对长折线做路径简化（合并近似共线的顶点）并分块渲染；
+# 通过rc_context只作用于本模块的绘图函数，不修改导入方的全局rcParams
+# （Figure直接绑定FigureCanvasAgg，也不需要切换后端）
+_RC_PARAMS = {
+    'path.simplify': True,
+    'path.simplify_threshold': 1.0,
+    'agg.path.chunksize': 10000,
+}
+
+# PNG使用最快的zlib压缩级别：文件稍大，但编码耗时显著降低
+_PNG_SAVE_OPTIONS = {'compress_level': 1}
+
+# 超过该点数的折线不绘制数据点标记（逐点绘制标记是渲染的主要开销）
+_MARKER_MAX_POINTS = 200
+
+# 超过该行数且datashader可用时，折线改为光栅化渲染（耗时与像素数相关，而非数据点数）
+_DATASHADER_MIN_ROWS = 50_000
+
+# 条件概率图的位置数超过该值时，图例只列出峰值概率最高的_LEGEND_TOP_K个位置
+# （图例排版耗时随条目数增长，数百条目时占保存耗时的大头）
+_LEGEND_MAX_ENTRIES = 50
+_LEGEND_TOP_K = 10
+
+# 各CSV中绘图实际用到的列及其类型（其余列不解析）
+_BATCH_DTYPES = {
+    'time': 'float64', 'batch_id': 'int32', 'batch_tokens': 'int32',
+    'running_count': 'int32', 'waiting_count': 'int32', 'gpu_memory_used': 'int32',
+    'completed_count': 'int32', 'batch_sacrifice_count': 'int32',
+}
+_SACRIFICE_DTYPES = {
+    'time': 'float64', 'current_decode_position': 'int32', 'memory_freed': 'int64',
+    'running_count_same_position': 'int32', 'total_running_count': 'int32',
+}
+_REQUEST_DTYPES = {
+    'arrival_time': 'float64', 'completion_time': 'float64',
+    'decode_length': 'int64', 'total_delay': 'float64',
+}
+
+
+def _read_csv(path: str, dtypes: dict = None) -> pd.DataFrame:
+    """
+    读取CSV文件，pyarrow可用时使用其多线程解析引擎
+    
+    Args:
+        path: CSV文件路径
+        dtypes: 需要的列及其类型；只解析其中在文件里存在的列（可选列缺失时自动跳过）
+    """
+    kwargs = {'engine': _CSV_ENGINE}
+    if dtypes:
+        header = pd.read_csv(path, nrows=0).columns
+        columns = [col for col in dtypes if col in header]
+        kwargs['usecols'] = columns
+        kwargs['dtype'] = {col: dtypes[col] for col in columns}
+    return pd.read_csv(path, **kwargs)
+
+
+def _table_path(csv_path: str, table_format: str = 'csv') -> str:
+    """返回_write_table按table_format实际写入的文件路径"""
+    if table_format not in ('csv', 'parquet'):
+        raise ValueError(f"Unsupported table format: {table_format}")
+    return os.path.splitext(csv_path)[0] + '.parquet' if table_format == 'parquet' else csv_path
+
+
+def _write_table(df: pd.DataFrame, csv_path: str, table_format: str = 'csv') -> str:
+    """
+    保存宽格式数据表：默认写CSV，table_format='parquet'时写为同名的zstd压缩Parquet文件（需要pyarrow）
+    
+    Args:
+        df: 要保存的数据表
+        csv_path: CSV格式的目标路径
+        table_format: 输出格式，'csv'或'parquet'
+        
+    Returns:
+        实际写入的文件路径
+    """
+    path = _table_path(csv_path, table_format)
+    if table_format == 'parquet':
+        df.to_parquet(path, engine='pyarrow', compression='zstd', index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def _cum_probs_loop(positions, num_positions, out):
+    """逐事件累计各位置计数，out[i, p]为前i+1个事件中位置p的占比（超出范围的位置只计入分母）"""
+    counts = np.zeros(num_positions, np.int64)
+    for i in range(positions.shape[0]):
+        if positions[i] < num_positions:
+            counts[positions[i]] += 1
+        total = i + 1
+        for p in range(num_positions):
+            out[i, p] = counts[p] / total
+
+
+# numba可用时JIT编译上面的循环，避免one-hot矩阵及其cumsum产生的N x P临时数组
+_cum_probs_kernel = numba.njit(cache=True)(_cum_probs_loop) if numba is not None else None
+
+
+def _cumulative_probs(positions: np.ndarray, num_positions: int) -> np.ndarray:
+    """
+    计算每个sacrifice事件发生后各decode position的累积概率分布
+    
+    Args:
+        positions: 按时间排序的sacrifice位置序列
+        num_positions: 输出的位置列数
+        
+    Returns:
+        形状为(len(positions), num_positions)的float32矩阵
+    """
+    num_events = len(positions)
+    if _cum_probs_kernel is not None:
+        out = np.empty((num_events, num_positions), dtype=np.float32)
+        _cum_probs_kernel(positions, num_positions, out)
+        return out
+    
+    # 用one-hot编码 + 按行cumsum一次算出所有行；cumsum和除法都原地进行，只占用一个N x P矩阵
+    probs = np.zeros((num_events, num_positions), dtype=np.float32)
+    in_range = positions < num_positions
+    probs[np.nonzero(in_range)[0], positions[in_range]] = 1.0
+    np.cumsum(probs, axis=0, out=probs)
+    probs /= np.arange(1, num_events + 1, dtype=np.float32)[:, None]
+    return probs
+
+
+def _cond_probs_loop(time_idx, pos_idx, running_counts, sums, counts):
+    """逐事件累加每个(时间, 位置)的1/running_count之和与事件数"""
+    for i in range(time_idx.shape[0]):
+        sums[time_idx[i], pos_idx[i]] += 1.0 / running_counts[i]
+        counts[time_idx[i], pos_idx[i]] += 1
+
+
+_cond_probs_kernel = numba.njit(cache=True)(_cond_probs_loop) if numba is not None else None
+
+
+def _conditional_probs(times: np.ndarray, positions: np.ndarray, running_counts: np.ndarray):
+    """
+    计算每个时间点每个位置的条件概率P(sacrifice | position, time)
+    
+    每个事件的条件概率为1/running_count_same_position，对同一(时间, 位置)的事件取平均
+    
+    Args:
+        times: 各sacrifice事件的时间
+        positions: 各事件的decode position
+        running_counts: 各事件发生时同一位置上的运行请求数
+        
+    Returns:
+        (unique_times, unique_positions, probs)：probs形状为(时间数, 位置数)，
+        该时间未出现的位置为NaN
+    """
+    unique_times, time_idx = np.unique(times, return_inverse=True)
+    unique_positions, pos_idx = np.unique(positions, return_inverse=True)
+    shape = (len(unique_times), len(unique_positions))
+    
+    if _cond_probs_kernel is not None:
+        sums = np.zeros(shape)
+        counts = np.zeros(shape, dtype=np.int64)
+        _cond_probs_kernel(time_idx, pos_idx, running_counts, sums, counts)
+    else:
+        # 以展平的(时间, 位置)下标做一次加权bincount，代替逐组求平均
+        flat_idx = time_idx * shape[1] + pos_idx
+        size = shape[0] * shape[1]
+        sums = np.bincount(flat_idx, weights=1.0 / running_counts, minlength=size).reshape(shape)
+        counts = np.bincount(flat_idx, minlength=size).reshape(shape)
+    
+    probs = np.full(shape, np.nan)
+    np.divide(sums, counts, out=probs, where=counts > 0)
+    return unique_times, unique_positions, probs
+
+
+def _window_counts(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    统计落在每个时间窗口[edges[i], edges[i+1])内的值个数（NaN不计入）
+    
+    Args:
+        values: 时间值
+        edges: 单调递增的窗口边界
+        
+    Returns:
+        长度为len(edges)-1的计数数组
+    """
+    if len(edges) < 2:
+        # 只有一个边界（如max_time为0）时没有窗口
+        return np.zeros(0, dtype=np.int64)
+    values = values[~np.isnan(values)]
+    counts, _ = np.histogram(values, bins=edges)
+    # np.histogram的最后一个窗口包含右边界，这里保持左闭右开
+    counts[-1] -= np.count_nonzero(values == edges[-1])
+    return counts
+
+
+def _batch_times(df_batch: pd.DataFrame, batch_ids: list) -> list:
+    """
+    查找各batch_id对应的时间（只建一次索引，避免每个batch_id扫描整列）
+    
+    Args:
+        df_batch: batch快照数据（需包含batch_id和time列）
+        batch_ids: 要查找的batch_id列表
+        
+    Returns:
+        [(batch_id, time), ...]，按batch_ids顺序；不存在的batch_id被跳过，
+        同一batch_id出现多次时取第一行
+    """
+    # 反向构建字典，使重复的batch_id保留第一次出现的时间
+    batch_to_time = dict(zip(df_batch['batch_id'].to_numpy()[::-1], df_batch['time'].to_numpy()[::-1]))
+    return [(batch_id, batch_to_time[batch_id]) for batch_id in batch_ids if batch_id in batch_to_time]
+
+
+def _iter_csv_chunks(path: str, dtypes: dict, chunksize: int = 200_000):
+    """
+    分块读取CSV，只解析dtypes中存在于文件的列，峰值内存与文件大小无关
+    
+    Args:
+        path: CSV文件路径
+        dtypes: 需要的列及其类型（同_read_csv）
+        chunksize: 每次读取的行数
+        
+    Returns:
+        逐块产生DataFrame的迭代器（保持原始行号作为索引）
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    columns = [col for col in dtypes if col in header]
+    # pyarrow引擎不支持chunksize，分块读取使用默认引擎
+    return pd.read_csv(path, usecols=columns, dtype={col: dtypes[col] for col in columns},
+                       chunksize=chunksize)
+
+
+def _read_csv_decimated(path: str, dtypes: dict, max_points: int,
+                        keep=None, chunksize: int = 200_000, full_columns: list = None) -> tuple:
+    """
+    分块读取CSV并按固定步长抽样；抽样数据的大小与文件大小无关，
+    只有full_columns指定的少数列按完整行数保留
+    
+    Args:
+        path: CSV文件路径
+        dtypes: 需要的列及其类型（同_read_csv）
+        max_points: 抽样后保留的大致行数；为None或文件行数不超过该值时直接完整读取
+        keep: 可选的函数，接收一个数据块并返回布尔掩码，为True的行总是保留
+        chunksize: 每次读取的行数
+        full_columns: 需要保留全部行的列（在同一次分块读取中收集，不必再完整解析一遍文件）
+        
+    Returns:
+        (df, df_full)：df为抽样后的DataFrame（总是包含最后一行，保持原始行号作为索引），
+        发生抽样时df.attrs['decimated']为True；df_full为包含全部行的full_columns列，
+        未发生抽样时就是df本身，未指定full_columns时为None
+    """
+    with open(path, 'rb') as f:
+        num_rows = sum(buf.count(b'\n') for buf in iter(lambda: f.read(1 << 20), b'')) - 1
+    if max_points is None or num_rows <= max_points:
+        df = _read_csv(path, dtypes)
+        return df, df
+    
+    stride = -(-num_rows // max_points)
+    
+    parts = []
+    full_parts = []
+    last_row = None
+    for chunk in _iter_csv_chunks(path, dtypes, chunksize):
+        mask = chunk.index.to_numpy() % stride == 0
+        if keep is not None:
+            mask |= keep(chunk).to_numpy()
+        parts.append(chunk[mask])
+        if full_columns is not None:
+            full_parts.append(chunk[full_columns])
+        last_row = chunk.iloc[[-1]]
+    
+    if last_row is not None and not mask[-1]:
+        parts.append(last_row)
+    df = pd.concat(parts)
+    df.attrs['decimated'] = True
+    df_full = pd.concat(full_parts) if full_columns is not None else None
+    return df, df_full
+
+
+def _is_up_to_date(output_paths, *input_paths: str) -> bool:
+    """
+    所有输出文件都存在且比所有（存在的）输入文件都新时返回True，此时可以跳过重新绘制
+    
+    只比较文件时间，不知道图像内容还取决于哪些绘图参数：调用方传入了影响图像的参数时不应跳过
+    
+    Args:
+        output_paths: 输出文件路径，或输出文件路径列表（图片及随之保存的数据表）
+        input_paths: 输入文件路径
+    """
+    if isinstance(output_paths, str):
+        output_paths = [output_paths]
+    if not all(os.path.exists(path) for path in output_paths):
+        return False
+    output_mtime = min(os.path.getmtime(path) for path in output_paths)
+    return all(os.path.getmtime(path) < output_mtime
+               for path in input_paths if os.path.exists(path))
+
+
+def _plot_index(num_points: int, max_points: int = 20000) -> np.ndarray:
+    """
+    返回按固定步长抽样的绘图下标（总是包含最后一个点），只用于绘图，统计仍使用完整数据
+    """
+    step = max(1, num_points // max_points)
+    index = np.arange(0, num_points, step)
+    if num_points and index[-1] != num_points - 1:
+        index = np.append(index, num_points - 1)
+    return index
+
+
+def _get_figure(nrows: int, figsize: tuple):
+    """
+    获取nrows x 1布局的Figure，启用缓存时复用同规格的Figure
+    
+    Figure直接绑定FigureCanvasAgg，不经过pyplot的全局状态（不注册figure manager），
+    因此可以在多进程中安全地并行绘制；调用方使用返回的fig（fig.savefig等），
+    绘制完成后调用_release_figure。
+    缓存的Figure在_release_figure中已被清空，复用时总是新建子图，
+    因此不会残留上一张图的坐标轴状态（tick_params、坐标刻度类型、纵横比等）
+    
+    Args:
+        nrows: 子图行数
+        figsize: 图片尺寸
+        
+    Returns:
+        (fig, axes)
+    """
+    key = (nrows, figsize)
+    fig = _FIG_CACHE.get(key) if _FIG_CACHE_ENABLED else None
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        if _FIG_CACHE_ENABLED:
+            _FIG_CACHE[key] = fig
+    else:
+        # tight_layout会修改子图参数，先恢复默认值，使布局结果与新建Figure一致
+        fig.subplots_adjust(**{param: matplotlib.rcParams[f'figure.subplot.{param}']
+                               for param in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+    return fig, fig.subplots(nrows, 1)
+
+
+def _release_figure(fig):
+    """绘制完成后清空Figure（子图、总标题及全部绘图元素），使其尽快被回收或在缓存中以空白状态复用"""
+    fig.clear()
+
+
+def _plot_series(ax, x: np.ndarray, y: np.ndarray, label: str, color: str, **line_kwargs):
+    """
+    绘制一条时间序列；点数超过_MARKER_MAX_POINTS时去掉数据点标记，
+    数据点很多且datashader可用时先光栅化为图像再用imshow显示
+    
+    Args:
+        ax: 目标坐标轴
+        x, y: 数据
+        label: 图例标签
+        color: 线条颜色
+        line_kwargs: 使用matplotlib绘制时传给ax.plot的其他参数
+    """
+    if len(x) > _MARKER_MAX_POINTS:
+        line_kwargs['marker'] = None
+    
+    if ds is None or len(x) <= _DATASHADER_MIN_ROWS:
+        ax.plot(x, y, label=label, color=color, rasterized=True, **line_kwargs)
+        return
+    
+    x, y = np.asarray(x), np.asarray(y)
+    x_range = (float(x.min()), float(x.max()))
+    y_range = (float(y.min()), float(y.max()))
+    if y_range[0] == y_range[1]:
+        y_range = (y_range[0] - 0.5, y_range[1] + 0.5)
+    
+    canvas = ds.Canvas(plot_width=1400, plot_height=500, x_range=x_range, y_range=y_range)
+    agg = canvas.line(pd.DataFrame({'x': x, 'y': y}), 'x', 'y', agg=ds.count())
+    img = ds_tf.shade(agg, cmap=[color])
+    ax.imshow(img.to_pil(), extent=(*x_range, *y_range), origin='upper', aspect='auto')
+    # 图像本身没有图例条目，添加一个代理线条
+    ax.plot([], [], label=label, color=color, linewidth=line_kwargs.get('linewidth'))
+
+
+@matplotlib.rc_context(_RC_PARAMS)
 def plot_queue_dynamics(csv_path: str, arrival_end: float = None, 
                        M_total: int = None, B_total: int = None,
                        d_0: float = None, d_1: float = None,
                        num_requests: int = None, state_save_batches: list = None,
                        mode: str = None, theoretical_lambda: float = None,
                        truncation_info: dict = None, request_file: str = None,
-                       regression_interval: list = None, admission_control: dict = None):
+                       regression_interval: list = None, admission_control: dict = None,
+                       max_points: int = 20000, force: bool = False,
+                       table_format: str = 'csv'):
     """
     Plot system dynamics in two subplots (2x1 layout)
     
@@ -36,17 +437,78 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
         request_file: Path to request file (optional)
         regression_interval: Interval for linear regression (optional)
         admission_control: Dictionary with admission control settings (optional)
+        max_points: Downsample longer snapshot files to about this many rows for plotting;
+                    batches with sacrifices or state saves are always kept. Use None to plot
+                    every row (very long series are then rasterized with datashader if installed)
+        force: Re-plot even if the figures are newer than their CSV inputs. By default each
+               up-to-date figure is skipped on its own, but only when none of the optional
+               arguments that shape that figure were passed and its saved tables (in
+               table_format) are also up to date; after changing only max_points pass force=True
+        table_format: File format of the sacrifice distribution tables, 'csv' or 'parquet'
+                      (parquet requires pyarrow)
     """
     if not os.path.exists(csv_path):
         print(f"Error: {csv_path} not found")
         return
     
-    # Load data
-    df = pd.read_csv(csv_path)
+    # Get directory path from CSV path
+    exp_dir = os.path.dirname(csv_path)
+    output_path = os.path.join(exp_dir, 'queue_dynamics.png')
+    
+    def plot_follow_ups(df_batch=None, df_sacrifice=None, df_requests=None):
+        # 后续三张图各自检查输出是否过期；未传入的数据由各函数在需要重绘时自行读取
+        # 如果存在sacrifice数据，绘制sacrifice动态图
+        plot_sacrifice_dynamics(exp_dir, request_file=None, df_sacrifice=df_sacrifice, force=force,
+                                table_format=table_format)
+        
+        # 绘制arrival dynamics图（external vs internal）
+        plot_arrival_dynamics(exp_dir, request_file=request_file, 
+                             mode=mode, truncation_info=truncation_info,
+                             state_save_batches=state_save_batches,
+                             d_0=d_0, d_1=d_1,
+                             regression_interval=regression_interval,
+                             df_batch=df_batch, df_sacrifice=df_sacrifice,
+                             df_requests=df_requests, force=force)
+        
+        # 绘制性能指标图（throughput和latency）
+        plot_performance_metrics(exp_dir, mode=mode, truncation_info=truncation_info,
+                                state_save_batches=state_save_batches,
+                                admission_control=admission_control,
+                                df_batch=df_batch, df_requests=df_requests, force=force)
+    
+    # 图中的标注和标题取决于这些参数，传入任何一个时都重新绘制
+    figure_args = (arrival_end, M_total, B_total, d_0, d_1, num_requests, state_save_batches,
+                   mode, theoretical_lambda, truncation_info, admission_control)
+    if not force and all(arg is None for arg in figure_args) \
+            and _is_up_to_date(output_path, csv_path):
+        print(f"Queue dynamics up to date, skipping: {output_path}")
+        plot_follow_ups()
+        return
+    
+    # Load data (chunked and downsampled for very long runs)
+    save_batch_ids = list(state_save_batches or [])
+    
+    def keep_rows(chunk):
+        keep = chunk['batch_id'].isin(save_batch_ids)
+        if 'batch_sacrifice_count' in chunk.columns:
+            keep |= chunk['batch_sacrifice_count'] > 0
+        return keep
+    
+    # 后续的arrival/performance图需要每个批次的时间、batch_id和batch_tokens（累积曲线、标记线、
+    # 间隔计算），在抽样的同一次读取中完整保留这三列，避免它们再各自完整解析一遍文件
+    df, df_batch = _read_csv_decimated(csv_path, _BATCH_DTYPES, max_points, keep=keep_rows,
+                                       full_columns=['time', 'batch_id', 'batch_tokens'])
     
     # Check if batch_sacrifice_count column exists
     has_sacrifice = 'batch_sacrifice_count' in df.columns
     
+    # Extract plotted columns as float32 ndarrays once (matplotlib handles raw arrays faster
+    # than Series, and plot-only data does not need float64 precision)
+    t, waiting, running, batch_tokens, gpu_memory = df[
+        ['time', 'waiting_count', 'running_count', 'batch_tokens', 'gpu_memory_used']
+    ].to_numpy(dtype=np.float32).T
+    sacrifice_counts = df['batch_sacrifice_count'].to_numpy() if has_sacrifice else None
+    
     # Calculate statistics
     total_time = float(df['time'].iloc[-1]) if len(df) > 0 else 0
     completed_count = int(df['completed_count'].iloc[-1]) if len(df) > 0 else 0
@@ -55,8 +517,8 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     avg_arrival_rate = num_requests / arrival_end if (arrival_end and arrival_end > 0) else 0
     avg_completion_rate = completed_count / total_time if total_time > 0 else 0
     
-    # Create figure with 2x1 subplot layout
-    fig, (ax1, ax3) = plt.subplots(2, 1, figsize=(14, 12))
+    # Create figure with 2x1 subplot layout (reused across calls)
+    fig, (ax1, ax3) = _get_figure(2, (14, 12))
     
     # Add super title with system parameters and statistics
     title_lines = []
@@ -164,17 +626,19 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     ax1.set_ylabel('Number of Requests', fontsize=12)
     
     # Plot waiting and running counts
-    ax1.plot(df['time'], df['waiting_count'], 
-            label='Waiting', color='blue', linewidth=2, marker='o', markersize=3)
-    ax1.plot(df['time'], df['running_count'], 
-            label='Running', color='green', linewidth=2, marker='s', markersize=3)
-    
-    # Plot sacrifice counts as bars (if available)
+    _plot_series(ax1, t, waiting, 
+                 label='Waiting', color='blue', linewidth=2,
+                 marker='o', markersize=3)
+    _plot_series(ax1, t, running, 
+                 label='Running', color='green', linewidth=2,
+                 marker='s', markersize=3)
+    
+    # Plot sacrifice counts as vertical bars (if available); one vlines collection
+    # instead of a Rectangle patch per batch
     if has_sacrifice:
-        # Use bar chart for per-batch sacrifice count
-        ax1.bar(df['time'], df['batch_sacrifice_count'], 
-                color='red', alpha=0.5, width=df['time'].diff().median() * 0.8,
-                label='Sacrifices per Batch')
+        ax1.vlines(t, 0, sacrifice_counts, 
+                   colors='red', alpha=0.5, linewidth=1.5,
+                   label='Sacrifices per Batch')
     
     # Add vertical line for arrival end time if provided
     if arrival_end is not None:
@@ -184,24 +648,17 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     # Add vertical lines for state save batches if provided
     if state_save_batches:
         # Find the times corresponding to these batch IDs
-        state_save_info = []
-        for batch_id in state_save_batches:
-            # Find the row with this batch_id
-            batch_rows = df[df['batch_id'] == batch_id]
-            if not batch_rows.empty:
-                save_time = batch_rows['time'].iloc[0]
-                state_save_info.append((batch_id, save_time))
-                ax1.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5, 
-                           alpha=0.6)
+        state_save_info = _batch_times(df, state_save_batches)
         
-        # Create a combined legend label with batch IDs and times
+        # Draw all markers as one full-height vlines collection with a combined legend label
         if state_save_info:
             batch_ids_str = str([b for b, _ in state_save_info])
             times_str = ', '.join([f'{t:.0f}' for _, t in state_save_info])
             legend_label = f'State Save {batch_ids_str}\n(t={times_str})'
-            # Add a dummy line for the legend
-            ax1.plot([], [], color='red', linestyle='--', linewidth=1.5, 
-                    alpha=0.6, label=legend_label)
+            ax1.vlines([t for _, t in state_save_info], 0, 1,
+                       transform=ax1.get_xaxis_transform(),
+                       colors='red', linestyles='--', linewidth=1.5, alpha=0.6,
+                       label=legend_label)
     
     # Set legend
     ax1.legend(loc='upper left', fontsize=10)
@@ -217,12 +674,14 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     ax3.set_ylabel('Number of Tokens', fontsize=12)
     
     # Plot batch tokens
-    ax3.plot(df['time'], df['batch_tokens'], 
-            label='Batch Tokens (after execution)', color='tab:blue', linewidth=2, marker='o', markersize=3)
+    _plot_series(ax3, t, batch_tokens, 
+                 label='Batch Tokens (after execution)', color='tab:blue', linewidth=2,
+                 marker='o', markersize=3)
     
     # Plot GPU memory used
-    ax3.plot(df['time'], df['gpu_memory_used'], 
-            label='GPU Memory Used', color='tab:orange', linewidth=2, marker='s', markersize=3)
+    _plot_series(ax3, t, gpu_memory, 
+                 label='GPU Memory Used', color='tab:orange', linewidth=2,
+                 marker='s', markersize=3)
     
     # Add horizontal line for B_total if provided
     if B_total is not None:
@@ -247,7 +706,7 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     
     # Optionally set upper limit based on max of M_total and data
     if M_total is not None:
-        max_val = max(M_total * 1.1, df['gpu_memory_used'].max() * 1.1)
+        max_val = max(M_total * 1.1, gpu_memory.max() * 1.1)
         ax3.set_ylim(top=max_val)
     
     # Set title for bottom subplot
@@ -255,45 +714,42 @@ def plot_queue_dynamics(csv_path: str, arrival_end: float = None,
     ax3.grid(True, alpha=0.3, linestyle='--')
     
     # Adjust layout to prevent label cutoff and make room for suptitle
-    plt.tight_layout(rect=[0, 0, 1, 0.95])
+    fig.tight_layout(rect=[0, 0, 1, 0.95])
     
-    # Get directory path from CSV path
-    exp_dir = os.path.dirname(csv_path)
-    
-    # Save figure
-    output_path = os.path.join(exp_dir, 'queue_dynamics.png')
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
+    # Save figure (tight_layout above already fits the content to the fixed figsize,
+    # so skip bbox_inches='tight' which costs an extra full render pass)
+    fig.savefig(output_path, dpi=150, metadata={}, pil_kwargs=_PNG_SAVE_OPTIONS)
     print(f"Figure saved to: {output_path}")
     
     # # Also save as PDF for publication quality
     # pdf_path = os.path.join(exp_dir, 'queue_dynamics.pdf')
-    # plt.savefig(pdf_path, bbox_inches='tight')
+    # fig.savefig(pdf_path, metadata={})
     # print(f"PDF saved to: {pdf_path}")
     
-    # Close the figure to free memory (no display)
-    plt.close(fig)
+    _release_figure(fig)
     
-    # 如果存在sacrifice数据，绘制sacrifice动态图
-    plot_sacrifice_dynamics(exp_dir, request_file=None)
-    
-    # 绘制arrival dynamics图（external vs internal）
-    plot_arrival_dynamics(exp_dir, request_file=request_file, 
-                         mode=mode, truncation_info=truncation_info,
-                         state_save_batches=state_save_batches,
-                         d_0=d_0, d_1=d_1,
-                         regression_interval=regression_interval)
+    # 后续三张图共用的数据只读取一次，直接传入已解析的DataFrame
+    # （batch数据被抽样过时传入的是读取时完整保留的time/batch_id/batch_tokens三列）
+    sacrifice_csv = os.path.join(exp_dir, 'sacrifice_snapshot.csv')
+    df_sacrifice = _read_csv(sacrifice_csv, _SACRIFICE_DTYPES) if os.path.exists(sacrifice_csv) else None
+    # request_traces.csv同时传给arrival图和性能指标图：后者需要完整数据，因此arrival图在这条
+    # 调用路径上不走分块读取
+    request_traces_csv = os.path.join(exp_dir, 'request_traces.csv')
+    df_requests = _read_csv(request_traces_csv, _REQUEST_DTYPES) if os.path.exists(request_traces_csv) else None
     
-    # 绘制性能指标图（throughput和latency）
-    plot_performance_metrics(exp_dir, mode=mode, truncation_info=truncation_info,
-                            state_save_batches=state_save_batches,
-                            admission_control=admission_control)
+    plot_follow_ups(df_batch, df_sacrifice, df_requests)
 
 
+@matplotlib.rc_context(_RC_PARAMS)
 def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
                          mode: str = None, truncation_info: dict = None,
                          state_save_batches: list = None,
                          d_0: float = None, d_1: float = None,
-                         regression_interval: list = None):
+                         regression_interval: list = None,
+                         df_batch: pd.DataFrame = None,
+                         df_sacrifice: pd.DataFrame = None,
+                         df_requests: pd.DataFrame = None,
+                         force: bool = False):
     """
     绘制外部到达(external arrival)和内部到达(internal arrival)的对比图
     
@@ -303,47 +759,58 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
         mode: 'explore'或'truncate'
         truncation_info: 截断信息字典
         state_save_batches: 标记批次列表
+        df_batch: 已读取的batch_snapshots.csv数据（可选，为None时从exp_dir读取）
+        df_sacrifice: 已读取的sacrifice_snapshot.csv数据（可选，为None时从exp_dir读取）
+        df_requests: 已读取的request_traces.csv数据（可选，为None时从exp_dir分块读取，
+                     峰值内存只与块大小和窗口数有关）
+        force: 为False且未传入影响图像的参数（request_file、mode、truncation_info、state_save_batches、
+               d_0/d_1、regression_interval）时，若arrival_dynamics.png比输入CSV都新则跳过绘制
     """
-    import csv
-    
     # 检查sacrifice_snapshot.csv是否存在
     sacrifice_csv = os.path.join(exp_dir, 'sacrifice_snapshot.csv')
-    if not os.path.exists(sacrifice_csv):
+    if df_sacrifice is None and not os.path.exists(sacrifice_csv):
         print("No sacrifice_snapshot.csv found, skipping arrival dynamics plot")
         return
     
     # 读取batch_snapshots.csv获取时间信息
     batch_csv = os.path.join(exp_dir, 'batch_snapshots.csv')
-    if not os.path.exists(batch_csv):
+    request_traces_csv = os.path.join(exp_dir, 'request_traces.csv')
+    output_path = os.path.join(exp_dir, 'arrival_dynamics.png')
+    figure_args = (request_file, mode, truncation_info, state_save_batches, d_0, d_1, regression_interval)
+    if not force and all(arg is None for arg in figure_args) \
+            and _is_up_to_date(output_path, sacrifice_csv, batch_csv, request_traces_csv):
+        print(f"Arrival dynamics up to date, skipping: {output_path}")
+        return
+    
+    if df_batch is None and not os.path.exists(batch_csv):
         print("No batch_snapshots.csv found, skipping arrival dynamics plot")
         return
     
     # 读取batch snapshots数据
-    df_batch = pd.read_csv(batch_csv)
+    if df_batch is None:
+        df_batch = _read_csv(batch_csv, _BATCH_DTYPES)
     
     # 读取sacrifice数据
-    df_sacrifice = pd.read_csv(sacrifice_csv)
+    if df_sacrifice is None:
+        df_sacrifice = _read_csv(sacrifice_csv, _SACRIFICE_DTYPES)
     if df_sacrifice.empty:
         print("No sacrifice events found, skipping arrival dynamics plot")
         return
     
     # 读取请求轨迹文件来获取external arrivals
-    request_traces_csv = os.path.join(exp_dir, 'request_traces.csv')
-    if not os.path.exists(request_traces_csv):
+    if df_requests is None and not os.path.exists(request_traces_csv):
         print("No request_traces.csv found, skipping arrival dynamics plot")
         return
     
-    df_requests = pd.read_csv(request_traces_csv)
-    
     # 获取时间范围 - 使用仿真的最大时间（最后一个批次的时间）
     # 这样即使arrival_end之后，仍然能看到internal arrivals
+    # 整列归约只算一次，两个子图的标记线和标题都复用这些值
     max_time = df_batch['time'].max() if not df_batch.empty else 0
+    B_max = df_batch['batch_tokens'].max() if not df_batch.empty else None
     
     # 使用系统批次时间作为统一间隔
     # 基于 d_0 + d_1 * B_max 计算间隔，但需要适当放大
-    if d_0 is not None and d_1 is not None and not df_batch.empty:
-        # 获取最大的batch_tokens
-        B_max = df_batch['batch_tokens'].max()
+    if d_0 is not None and d_1 is not None and B_max is not None:
         # 计算基础间隔
         base_interval = d_0 + d_1 * B_max
         # 使用一个合理的倍数（比如10倍）使间隔更合适
@@ -358,79 +825,59 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
         interval = max_time / 50 if max_time > 0 else 20
     
     # 创建固定时间窗口
+    # 窗口边界保持float64以便与事件时间精确比较；窗口中心点只用于绘图，用float32原地计算
     time_windows = np.arange(0, max_time + interval, interval)
-    window_centers = (time_windows[:-1] + time_windows[1:]) / 2  # 窗口中心点，用于绘图
-    
-    # 计算external arrivals - 固定时间窗口
-    external_incremental_windowed = []
-    external_cumulative_windowed = []
-    cumulative_count = 0
-    
-    for i in range(len(time_windows) - 1):
-        window_start = time_windows[i]
-        window_end = time_windows[i + 1]
-        # 统计这个窗口内的到达数
-        arrivals_in_window = len(df_requests[
-            (df_requests['arrival_time'] >= window_start) & 
-            (df_requests['arrival_time'] < window_end)
-        ])
-        external_incremental_windowed.append(arrivals_in_window)
-        cumulative_count += arrivals_in_window
-        external_cumulative_windowed.append(cumulative_count)
-    
-    # 计算internal arrivals - 映射到相同的时间窗口
-    internal_incremental_windowed = []
-    internal_cumulative_windowed = []
-    cumulative_sacrifice = 0
-    
-    for i in range(len(time_windows) - 1):
-        window_start = time_windows[i]
-        window_end = time_windows[i + 1]
-        # 统计这个窗口内的sacrifice数
-        sacrifices_in_window = len(df_sacrifice[
-            (df_sacrifice['time'] >= window_start) & 
-            (df_sacrifice['time'] < window_end)
-        ])
-        internal_incremental_windowed.append(sacrifices_in_window)
-        cumulative_sacrifice += sacrifices_in_window
-        internal_cumulative_windowed.append(cumulative_sacrifice)
-    
-    # 计算completions - 映射到相同的时间窗口
-    completion_incremental_windowed = []
-    
-    for i in range(len(time_windows) - 1):
-        window_start = time_windows[i]
-        window_end = time_windows[i + 1]
-        # 统计这个窗口内的完成数
-        completions_in_window = len(df_requests[
-            (df_requests['completion_time'] >= window_start) & 
-            (df_requests['completion_time'] < window_end) &
-            (df_requests['completion_time'].notna())
-        ])
-        completion_incremental_windowed.append(completions_in_window)
+    window_centers = time_windows[:-1].astype(np.float32)
+    window_centers += time_windows[1:]
+    window_centers *= 0.5
     
     # 为了兼容第一个子图（累积图），仍然计算基于batch时间点的累积值
     # 但这只用于第一个子图
-    batch_time_points = sorted(df_batch['time'].unique())
-    external_cumulative = []
-    internal_cumulative = []
-    completion_cumulative = []  # 添加完成累积
-    
-    for t in batch_time_points:
-        # 累积：到时间t为止到达的请求数
-        arrived = len(df_requests[df_requests['arrival_time'] <= t])
-        external_cumulative.append(arrived)
-        # 累积：到时间t为止的sacrifice数量
-        sacrificed = len(df_sacrifice[df_sacrifice['time'] <= t])
-        internal_cumulative.append(sacrificed)
-        # 累积：到时间t为止完成的请求数
-        # 注意：completion_time可能包含NaN（未完成的请求）
-        completed = len(df_requests[(df_requests['completion_time'] <= t) & 
-                                    (df_requests['completion_time'].notna())])
-        completion_cumulative.append(completed)
+    batch_time_points = np.unique(df_batch['time'].to_numpy())
+    
+    # 按固定时间窗口统计internal arrivals（sacrifice），一次直方图完成，而不是每个窗口重新扫描整列；
+    # 累积值 = 排序后的事件时间中 <= t 的个数，对所有batch时间点一次二分查找完成
+    internal_incremental_windowed = _window_counts(
+        df_sacrifice['time'].to_numpy(dtype=float), time_windows)
+    internal_cumulative = np.searchsorted(np.sort(df_sacrifice['time'].to_numpy()),
+                                          batch_time_points, side='right')
+    
+    # external arrivals和completions同样处理；请求轨迹可能很大，未传入时分块读取，
+    # 窗口计数和累积计数都可以按块累加，峰值内存只与块大小有关。
+    # 注意：经plot_queue_dynamics调用时总会传入完整的df_requests（性能指标图本来就要完整读取，
+    # 共用一次解析比再分块读一遍更省），分块读取只在直接调用本函数且不传df_requests时生效
+    if df_requests is not None:
+        request_chunks = [df_requests]
+    else:
+        request_chunks = _iter_csv_chunks(
+            request_traces_csv, {col: _REQUEST_DTYPES[col] for col in ('arrival_time', 'completion_time')})
+    
+    external_incremental_windowed = np.zeros(len(time_windows) - 1, dtype=np.int64)
+    completion_incremental_windowed = np.zeros_like(external_incremental_windowed)
+    external_cumulative = np.zeros(len(batch_time_points), dtype=np.int64)
+    completion_cumulative = np.zeros_like(external_cumulative)
+    last_arrival_time = None
+    for chunk in request_chunks:
+        if chunk.empty:
+            continue
+        arrivals = chunk['arrival_time'].to_numpy(dtype=float)
+        # 注意：completion_time可能包含NaN（未完成的请求），无需单独过滤：
+        # _window_counts会丢弃NaN，np.sort把NaN排在末尾，searchsorted不会把它计入 <= t
+        completions = chunk['completion_time'].to_numpy(dtype=float)
+        
+        external_incremental_windowed += _window_counts(arrivals, time_windows)
+        completion_incremental_windowed += _window_counts(completions, time_windows)
+        external_cumulative += np.searchsorted(np.sort(arrivals), batch_time_points, side='right')
+        completion_cumulative += np.searchsorted(np.sort(completions), batch_time_points, side='right')
+        
+        chunk_max = arrivals.max()
+        last_arrival_time = chunk_max if last_arrival_time is None else max(last_arrival_time, chunk_max)
+    
+    # 标记批次对应的时间（两个子图共用）
+    state_save_info = _batch_times(df_batch, state_save_batches) if state_save_batches else []
     
     # 创建2x1子图
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 12))
+    fig, (ax1, ax2) = _get_figure(2, (14, 12))
     
     # 添加标题（类似queue_dynamics的标题风格）
     title_lines = []
@@ -481,16 +928,16 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
     
     # 总体统计信息
     overall_stats = []
-    total_external = external_cumulative[-1] if external_cumulative else 0
-    total_internal = internal_cumulative[-1] if internal_cumulative else 0
-    total_completion = completion_cumulative[-1] if completion_cumulative else 0
+    total_external = int(external_cumulative[-1]) if len(external_cumulative) else 0
+    total_internal = int(internal_cumulative[-1]) if len(internal_cumulative) else 0
+    total_completion = int(completion_cumulative[-1]) if len(completion_cumulative) else 0
     
     overall_stats.append(f"Total External: {total_external}")
     overall_stats.append(f"Total Internal: {total_internal}")
     overall_stats.append(f"Total Completion: {total_completion}")
     
     # 计算平均速率
-    if batch_time_points:
+    if len(batch_time_points):
         total_time = batch_time_points[-1]
         if total_time > 0:
             avg_external_rate = total_external / total_time
@@ -514,26 +961,26 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
                     bbox=dict(boxstyle="round,pad=0.5", facecolor="lightgray", alpha=0.3))
     
     # ========== 第一个子图：累积到达 ==========
-    ax1.plot(batch_time_points, external_cumulative, 
-            label='External Arrival (Cumulative)', 
-            color='blue', linewidth=2, marker='o', markersize=3)
+    # 每个batch一个点，长仿真按步长抽样到约2万个点再绘制（回归仍使用完整数据）
+    plot_idx = _plot_index(len(batch_time_points))
+    plot_times = batch_time_points[plot_idx]
+    _plot_series(ax1, plot_times, external_cumulative[plot_idx], 
+                 label='External Arrival (Cumulative)', 
+                 color='blue', linewidth=2, marker='o', markersize=3)
     
-    ax1.plot(batch_time_points, internal_cumulative,
-            label='Internal Arrival from Sacrifice (Cumulative)',
-            color='red', linewidth=2, marker='s', markersize=3)
+    _plot_series(ax1, plot_times, internal_cumulative[plot_idx],
+                 label='Internal Arrival from Sacrifice (Cumulative)',
+                 color='red', linewidth=2, marker='s', markersize=3)
     
-    ax1.plot(batch_time_points, completion_cumulative,
-            label='Completion (Cumulative)',
-            color='green', linewidth=2, marker='^', markersize=3)
+    _plot_series(ax1, plot_times, completion_cumulative[plot_idx],
+                 label='Completion (Cumulative)',
+                 color='green', linewidth=2, marker='^', markersize=3)
     
     # 添加标记线（如果有）
     if state_save_batches and not df_batch.empty:
-        for batch_id in state_save_batches:
-            batch_rows = df_batch[df_batch['batch_id'] == batch_id]
-            if not batch_rows.empty:
-                save_time = batch_rows['time'].iloc[0]
-                ax1.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
-                           alpha=0.6)
+        for _, save_time in state_save_info:
+            ax1.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
+                       alpha=0.6)
         
         # 添加图例标记
         if state_save_batches:
@@ -544,14 +991,14 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
             ax1.plot([], [], color='red', linestyle='--', linewidth=1.5,
                     alpha=0.6, label=label)
     
-    # 添加arrival_end标记线（如果有）
+    # 添加arrival_end标记线（如果有，第二个子图复用）
     arrival_end_time = None
     if truncation_info and 'new_requests_end_time' in truncation_info:
         # 截断模式：使用新请求结束时间
         arrival_end_time = truncation_info.get('new_requests_end_time')
-    elif df_requests is not None and not df_requests.empty:
+    elif last_arrival_time is not None:
         # 探索模式或默认：使用最后一个请求的到达时间
-        arrival_end_time = df_requests['arrival_time'].max()
+        arrival_end_time = last_arrival_time
     
     if arrival_end_time is not None:
         ax1.axvline(x=arrival_end_time, color='black', linestyle='--', linewidth=2,
@@ -559,7 +1006,7 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
     
     # 添加仿真结束时间的标记线（绿色）
     if not df_batch.empty:
-        sim_end_time = df_batch['time'].max()
+        sim_end_time = max_time
         ax1.axvline(x=sim_end_time, color='green', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Simulation End ({sim_end_time:.1f})')
     
@@ -567,18 +1014,12 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
     if regression_interval and len(regression_interval) == 2:
         start_time, end_time = regression_interval
         
-        # 转换为numpy数组以便使用布尔索引
-        batch_time_points_arr = np.array(batch_time_points)
-        external_cumulative_arr = np.array(external_cumulative)
-        internal_cumulative_arr = np.array(internal_cumulative)
-        completion_cumulative_arr = np.array(completion_cumulative)
-        
         # 筛选时间范围内的数据点
-        mask = (batch_time_points_arr >= start_time) & (batch_time_points_arr <= end_time)
-        reg_times = batch_time_points_arr[mask]
-        reg_external = external_cumulative_arr[mask]
-        reg_internal = internal_cumulative_arr[mask]
-        reg_completion = completion_cumulative_arr[mask]
+        mask = (batch_time_points >= start_time) & (batch_time_points <= end_time)
+        reg_times = batch_time_points[mask]
+        reg_external = external_cumulative[mask]
+        reg_internal = internal_cumulative[mask]
+        reg_completion = completion_cumulative[mask]
         
         if len(reg_times) > 1:
             # 对三条线分别进行线性回归
@@ -641,55 +1082,40 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
     # 使用折线图显示固定窗口的增量
     
     # 外部到达的折线图 - 平滑的线，反映实际到达率
-    ax2.plot(window_centers, external_incremental_windowed,
-            label='External Arrival Rate (per window)',
-            color='blue', linewidth=2, marker='o', markersize=3, alpha=0.8)
+    _plot_series(ax2, window_centers, external_incremental_windowed,
+                 label='External Arrival Rate (per window)',
+                 color='blue', linewidth=2, marker='o', markersize=3, alpha=0.8)
     
     # 内部到达的折线图 - 可能较稀疏
-    ax2.plot(window_centers, internal_incremental_windowed,
-            label='Internal Arrival from Sacrifice (per window)',
-            color='red', linewidth=2, marker='s', markersize=3, alpha=0.8)
+    _plot_series(ax2, window_centers, internal_incremental_windowed,
+                 label='Internal Arrival from Sacrifice (per window)',
+                 color='red', linewidth=2, marker='s', markersize=3, alpha=0.8)
     
     # 完成的折线图
-    ax2.plot(window_centers, completion_incremental_windowed,
-            label='Completion Rate (per window)',
-            color='green', linewidth=2, marker='^', markersize=3, alpha=0.8)
+    _plot_series(ax2, window_centers, completion_incremental_windowed,
+                 label='Completion Rate (per window)',
+                 color='green', linewidth=2, marker='^', markersize=3, alpha=0.8)
     
     # 添加标记线（如果有）
     if state_save_batches and not df_batch.empty:
-        for batch_id in state_save_batches:
-            batch_rows = df_batch[df_batch['batch_id'] == batch_id]
-            if not batch_rows.empty:
-                save_time = batch_rows['time'].iloc[0]
-                ax2.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
-                           alpha=0.6)
-    
-    # 添加arrival_end标记线（如果有）- 这个在第一个子图中已经有了，第二个子图也需要
-    # 从truncation_info或其他参数中获取arrival_end时间
-    arrival_end_time = None
-    if truncation_info and 'new_requests_end_time' in truncation_info:
-        # 截断模式：使用新请求结束时间
-        arrival_end_time = truncation_info.get('new_requests_end_time')
-    elif df_requests is not None and not df_requests.empty:
-        # 探索模式或默认：使用最后一个请求的到达时间
-        arrival_end_time = df_requests['arrival_time'].max()
+        for _, save_time in state_save_info:
+            ax2.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
+                       alpha=0.6)
     
+    # 添加arrival_end标记线（如果有）- 第一个子图中已经算出，这里直接复用
     if arrival_end_time is not None:
         ax2.axvline(x=arrival_end_time, color='black', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Arrival End ({arrival_end_time:.1f})')
     
     # 添加仿真结束时间的标记线（绿色）
     if not df_batch.empty:
-        sim_end_time = df_batch['time'].max()
         ax2.axvline(x=sim_end_time, color='green', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Simulation End ({sim_end_time:.1f})')
     
     ax2.set_xlabel('Time', fontsize=12)
     ax2.set_ylabel(f'Number of Requests (per {interval:.0f} time units)', fontsize=12)
     # 如果使用了d_0 + d_1 * B_max计算间隔，在标题中显示
-    if d_0 is not None and d_1 is not None and not df_batch.empty:
-        B_max = df_batch['batch_tokens'].max()
-        base_interval = d_0 + d_1 * B_max
+    if d_0 is not None and d_1 is not None and B_max is not None:
         title_suffix = f" (interval: {interval:.0f} ≈ {ws}×({d_0:.3f} + {d_1:.5f}×{B_max:.0f}))"
     else:
         title_suffix = f" (interval: {interval:.0f})"
@@ -699,30 +1125,54 @@ def plot_arrival_dynamics(exp_dir: str, request_file: str = None,
     ax2.set_ylim(bottom=0)
     
     # 调整布局
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
+    fig.tight_layout(rect=[0, 0, 1, 0.96])
     
     # 保存图片
-    output_path = os.path.join(exp_dir, 'arrival_dynamics.png')
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
+    fig.savefig(output_path, dpi=150, pil_kwargs=_PNG_SAVE_OPTIONS)
     print(f"Arrival dynamics saved to: {output_path}")
-    plt.close(fig)
+    _release_figure(fig)
 
 
-def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
+@matplotlib.rc_context(_RC_PARAMS)
+def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None,
+                            df_sacrifice: pd.DataFrame = None,
+                            max_decode_position: int = None,
+                            force: bool = False, table_format: str = 'csv'):
     """
     绘制sacrifice动态图并保存分布数据
     
     Args:
         exp_dir: 实验目录路径
         request_file: 原始请求文件路径（用于获取max_decode_length）
+        df_sacrifice: 已读取的sacrifice_snapshot.csv数据（可选，为None时从exp_dir读取）
+        max_decode_position: 理论最大解码位置（可选，给定时不再读取request_file）
+        force: 为False且未传入request_file/max_decode_position时，若sacrifice_dynamics.png
+               和按table_format保存的分布数据表都比sacrifice_snapshot.csv新则跳过绘制
+        table_format: 分布数据表的保存格式，'csv'（默认）或'parquet'（需要pyarrow）
     """
-    # 检查sacrifice_snapshot.csv是否存在
     sacrifice_csv = os.path.join(exp_dir, 'sacrifice_snapshot.csv')
-    if not os.path.exists(sacrifice_csv):
-        return  # 没有sacrifice事件，跳过
+    output_path = os.path.join(exp_dir, 'sacrifice_dynamics.png')
+    if not force and request_file is None and max_decode_position is None \
+            and os.path.exists(sacrifice_csv):
+        # 图片和数据表一起检查：换了table_format时对应格式的数据表还不存在，需要重新生成
+        output_paths = [output_path,
+                        _table_path(os.path.join(exp_dir, 'sacrifice_distribution.csv'), table_format)]
+        header = pd.read_csv(sacrifice_csv, nrows=0).columns
+        if 'running_count_same_position' in header and 'total_running_count' in header:
+            output_paths.append(_table_path(
+                os.path.join(exp_dir, 'sacrifice_conditional_prob_timeline.csv'), table_format))
+        if _is_up_to_date(output_paths, sacrifice_csv):
+            print(f"Sacrifice dynamics up to date, skipping: {output_path}")
+            return
+    
+    if df_sacrifice is None:
+        # 检查sacrifice_snapshot.csv是否存在
+        if not os.path.exists(sacrifice_csv):
+            return  # 没有sacrifice事件，跳过
+        
+        # 读取sacrifice数据
+        df_sacrifice = _read_csv(sacrifice_csv, _SACRIFICE_DTYPES)
     
-    # 读取sacrifice数据
-    df_sacrifice = pd.read_csv(sacrifice_csv)
     if df_sacrifice.empty:
         return
     
@@ -737,9 +1187,9 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
     actual_max_position = int(df_sacrifice['current_decode_position'].max())
     
     # 理论最大decode长度（如果有请求文件）
-    theoretical_max_length = None
-    if request_file and os.path.exists(request_file):
-        df_requests = pd.read_csv(request_file)
+    theoretical_max_length = max_decode_position
+    if theoretical_max_length is None and request_file and os.path.exists(request_file):
+        df_requests = _read_csv(request_file, {'decode_length': 'int64'})
         # decode_length是长度，位置是0到length-1
         theoretical_max_length = int(df_requests['decode_length'].max()) - 1
     
@@ -756,31 +1206,23 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
     
     # 创建子图：如果有上下文数据则3x1，否则2x1
     if has_context:
-        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(14, 16))
+        fig, (ax1, ax2, ax3) = _get_figure(3, (14, 16))
     else:
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 12))
+        fig, (ax1, ax2) = _get_figure(2, (14, 12))
     
     # ========== 第一个子图：双纵轴 ==========
-    # 获取所有唯一时间点并排序
-    unique_times = sorted(df_sacrifice['time'].unique())
-    
-    # 统计每个时间点的sacrifice数量和浪费tokens
-    time_stats = []
-    for t in unique_times:
-        df_t = df_sacrifice[df_sacrifice['time'] == t]
-        time_stats.append({
-            'time': t,
-            'count': len(df_t),
-            'memory_freed': df_t['memory_freed'].sum()
-        })
-    df_stats = pd.DataFrame(time_stats)
-    
-    # 左纵轴：请求数量（柱状图）
+    # 统计每个时间点的sacrifice数量和浪费tokens（按时间排序，一次groupby完成）
+    df_stats = df_sacrifice.groupby('time', sort=True).agg(
+        count=('memory_freed', 'size'),
+        memory_freed=('memory_freed', 'sum')
+    ).reset_index()
+    unique_times = df_stats['time'].to_numpy()
+    
+    # 左纵轴：请求数量（竖线柱，一个vlines集合代替每个时间点一个矩形）
     ax1_left = ax1
-    bar_width = np.diff(unique_times).mean() * 0.8 if len(unique_times) > 1 else 1.0
-    ax1_left.bar(df_stats['time'], df_stats['count'], 
-                 width=bar_width, color='blue', alpha=0.5, 
-                 label='Sacrificed Requests per Time')
+    ax1_left.vlines(unique_times, 0, df_stats['count'].to_numpy(), 
+                    colors='blue', alpha=0.5, linewidth=1.5,
+                    label='Sacrificed Requests per Time')
     ax1_left.set_xlabel('Time', fontsize=12)
     ax1_left.set_ylabel('Number of Sacrificed Requests', color='blue', fontsize=12)
     ax1_left.tick_params(axis='y', labelcolor='blue')
@@ -788,9 +1230,9 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
     # 右纵轴：累计浪费的tokens（线图）
     ax1_right = ax1.twinx()
     cumulative_wasted = df_stats['memory_freed'].cumsum()
-    ax1_right.plot(df_stats['time'], cumulative_wasted, 
-                   color='red', linewidth=2, marker='o', markersize=4,
-                   label='Cumulative Wasted Tokens')
+    _plot_series(ax1_right, df_stats['time'], cumulative_wasted, 
+                 color='red', linewidth=2, marker='o', markersize=4,
+                 label='Cumulative Wasted Tokens')
     ax1_right.set_ylabel('Cumulative Wasted Tokens', color='red', fontsize=12)
     ax1_right.tick_params(axis='y', labelcolor='red')
     
@@ -804,52 +1246,31 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
     
     # ========== 第二个子图：概率分布 ==========
     # 创建概率矩阵（时间 x 位置）
-    prob_matrix_list = []
-    
     # 为每个sacrifice事件计算到该时间点的累积分布
     # 这样如果有899个事件，就会有899行
-    for idx in range(len(df_sacrifice)):
-        current_time = df_sacrifice.iloc[idx]['time']
-        
-        # 获取到当前时间为止的所有sacrifice事件（包括当前）
-        df_until_now = df_sacrifice.iloc[:idx+1]
-        
-        # 统计各decode_position的数量
-        position_counts = df_until_now['current_decode_position'].value_counts()
-        total_count = len(df_until_now)
-        
-        # 创建这个时间点的概率行
-        row_data = {'time': current_time}
-        for pos in range(max_decode_position + 1):
-            prob = position_counts.get(pos, 0) / total_count if total_count > 0 else 0
-            row_data[f'position_{pos}'] = prob
-        
-        prob_matrix_list.append(row_data)
+    # 一次算出所有行，避免逐事件切片再value_counts的O(N²)循环
+    # 超出绘图范围的位置（大于理论最大值）不单独成列，但仍计入分母
+    positions = df_sacrifice['current_decode_position'].to_numpy(dtype=np.int32)
+    num_positions = max_decode_position + 1
+    cum_probs = _cumulative_probs(positions, num_positions)
     
-    # 转换为DataFrame
-    prob_matrix = pd.DataFrame(prob_matrix_list)
-    
-    if not prob_matrix.empty:
+    if len(cum_probs):
         # 绘制所有decode positions的概率分布线条
         # 使用matplotlib的默认颜色循环
         # 获取默认的颜色循环
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         colors = prop_cycle.by_key()['color']
         
-        # 绘制所有位置的线条
-        for pos in range(max_decode_position + 1):
-            col_name = f'position_{pos}'
-            if col_name in prob_matrix.columns:
-                # 获取这个位置的概率序列
-                probs = prob_matrix[col_name].astype(float)
-                times = prob_matrix['time'].astype(float)
-                
-                # 绘制所有线条，即使概率很小
-                # 使用颜色循环
-                color = colors[pos % len(colors)]
-                ax2.plot(times, probs, 
-                        color=color, linewidth=0.8, alpha=0.8,
-                        label=f'Pos {pos}')
+        # 绘制所有位置的线条（即使概率很小），合并为一个LineCollection
+        # 位置可能有数百个，一个集合只需一次绘制，而不是每个位置一个Line2D
+        # 直接使用float32的(时间, 位置)概率数组，保存时才构建DataFrame
+        times = df_sacrifice['time'].to_numpy(dtype=np.float32)
+        segments = np.stack([np.broadcast_to(times[:, None], cum_probs.shape), cum_probs],
+                            axis=-1).transpose(1, 0, 2)  # (位置, 时间, 2)
+        line_colors = [colors[pos % len(colors)] for pos in range(num_positions)]
+        ax2.add_collection(LineCollection(segments, colors=line_colors, linewidths=0.8, alpha=0.8,
+                                          rasterized=True))
+        ax2.autoscale_view()
         
         ax2.set_xlabel('Time', fontsize=12)
         ax2.set_ylabel('Probability', fontsize=12)
@@ -857,8 +1278,15 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
         ax2.set_title('Distribution of Sacrifice Positions Over Time (Cumulative)', 
                      fontsize=14, fontweight='bold')
         
-        # 显示图例（可能会很多，使用小字体和多列）
-        ax2.legend(bbox_to_anchor=(1.05, 1), loc='upper left', 
+        # 显示图例：位置较少时逐个列出，否则只用一个代理条目（数百行图例本身就很耗时）
+        if num_positions <= 10:
+            legend_handles = [Line2D([], [], color=line_colors[pos], linewidth=0.8, alpha=0.8,
+                                     label=f'Pos {pos}')
+                              for pos in range(num_positions)]
+        else:
+            legend_handles = [Line2D([], [], color=colors[0], linewidth=0.8, alpha=0.8,
+                                     label=f'Pos 0-{max_decode_position} (one line per position)')]
+        ax2.legend(handles=legend_handles, bbox_to_anchor=(1.05, 1), loc='upper left', 
                   ncol=3, fontsize=6)
         
         ax2.grid(True, alpha=0.3, linestyle='--')
@@ -868,56 +1296,52 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
         # 计算每个时间点每个位置的条件概率
         # P(sacrifice | position, time) = 对该时间该位置的所有事件，先算每行概率再平均
         
-        # 获取所有唯一时间点
-        unique_times = sorted(df_sacrifice['time'].unique())
-        
-        # 创建时间-位置-概率映射
-        time_position_prob = {}
-        
-        for t in unique_times:
-            time_events = df_sacrifice[df_sacrifice['time'] == t]
-            time_position_prob[t] = {}
-            
-            # 对每个decode_position计算条件概率
-            for pos in time_events['current_decode_position'].unique():
-                pos_events = time_events[time_events['current_decode_position'] == pos]
-                
-                # 计算每行的条件概率（1/running_count_same_position）
-                # 这表示：在该位置有N个请求时，这个请求被选中sacrifice的概率
-                row_probs = 1.0 / pos_events['running_count_same_position']
-                
-                # 求平均作为该时间该位置的条件概率
-                avg_prob = row_probs.mean()
-                
-                time_position_prob[t][pos] = avg_prob
+        # 每行的条件概率为1/running_count_same_position，表示：在该位置有N个请求时，
+        # 这个请求被选中sacrifice的概率；按(时间, 位置)求平均即为该时间该位置的条件概率
+        # 一次完成，结果为宽表（行：时间，列：位置），该时间未出现的位置为NaN
+        unique_times, unique_positions, probs = _conditional_probs(
+            df_sacrifice['time'].to_numpy(),
+            df_sacrifice['current_decode_position'].to_numpy(),
+            df_sacrifice['running_count_same_position'].to_numpy(dtype=np.float64))
+        cond_prob = pd.DataFrame(probs, index=pd.Index(unique_times, name='time'),
+                                 columns=unique_positions)
         
         # 准备绘图数据
         # 为每个出现过的decode_position创建一条时间序列线
-        all_positions = sorted(set(
-            pos for time_dict in time_position_prob.values() 
-            for pos in time_dict.keys()
-        ))
+        all_positions = cond_prob.columns.tolist()
+        cond_times = cond_prob.index.to_numpy(dtype=np.float32)
+        cond_values = cond_prob.to_numpy(dtype=np.float32)
         
         # 使用matplotlib的默认颜色循环
-        prop_cycle = plt.rcParams['axes.prop_cycle']
+        prop_cycle = matplotlib.rcParams['axes.prop_cycle']
         colors = prop_cycle.by_key()['color']
         
-        # 绘制每个位置的概率时间序列
+        # 绘制每个位置的概率时间序列：所有线段合并为一个LineCollection，
+        # 数据点标记合并为一次scatter，图例使用代理条目
+        segments = []
+        line_colors = []
+        legend_handles = []
+        legend_peaks = []
         for i, pos in enumerate(all_positions):
-            times = []
-            probs = []
-            
-            for t in unique_times:
-                if pos in time_position_prob[t]:
-                    times.append(t)
-                    probs.append(time_position_prob[t][pos])
+            present = ~np.isnan(cond_values[:, i])
             
-            if times:  # 只绘制有数据的位置
+            if present.any():  # 只绘制有数据的位置
                 color = colors[i % len(colors)]
-                ax3.plot(times, probs, 
-                        color=color, linewidth=1.5, alpha=0.8,
-                        marker='o', markersize=3,
-                        label=f'Position {pos}')
+                segments.append(np.column_stack([cond_times[present], cond_values[present, i]]))
+                line_colors.append(color)
+                legend_handles.append(Line2D([], [], color=color, linewidth=1.5, alpha=0.8,
+                                             marker='o', markersize=3,
+                                             label=f'Position {pos}'))
+                legend_peaks.append(cond_values[present, i].max())
+        
+        if segments:
+            ax3.add_collection(LineCollection(segments, colors=line_colors, linewidths=1.5, alpha=0.8,
+                                              rasterized=True))
+            marker_points = np.concatenate(segments)
+            marker_colors = [color for color, seg in zip(line_colors, segments) for _ in range(len(seg))]
+            ax3.scatter(marker_points[:, 0], marker_points[:, 1], c=marker_colors, s=9, alpha=0.8,
+                        rasterized=True)
+            ax3.autoscale_view()
         
         ax3.set_xlabel('Time', fontsize=12)
         ax3.set_ylabel('Conditional Probability P(sacrifice | position, time)', fontsize=12)
@@ -925,68 +1349,57 @@ def plot_sacrifice_dynamics(exp_dir: str, request_file: str = None):
         ax3.set_title('Conditional Probability of Sacrifice Over Time', 
                      fontsize=14, fontweight='bold')
         
-        # 添加图例（可能会很多，使用小字体和多列）
-        if len(all_positions) > 10:
-            ax3.legend(bbox_to_anchor=(1.05, 1), loc='upper left', 
+        # 添加图例（可能会很多，使用小字体和多列；过多时只列出峰值最高的几个位置）
+        if len(legend_handles) > _LEGEND_MAX_ENTRIES:
+            # 峰值相同时保留较小的位置
+            top_k = np.sort(np.argsort(-np.asarray(legend_peaks), kind='stable')[:_LEGEND_TOP_K])
+            ax3.legend(handles=[legend_handles[i] for i in top_k],
+                      title=f'Top {len(top_k)} of {len(legend_handles)} positions (by peak)',
+                      bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=6, title_fontsize=7)
+        elif len(legend_handles) > 10:
+            ax3.legend(handles=legend_handles, bbox_to_anchor=(1.05, 1), loc='upper left', 
                       ncol=2, fontsize=6)
         else:
-            ax3.legend(loc='upper right', fontsize=8)
+            ax3.legend(handles=legend_handles, loc='upper right', fontsize=8)
         
         ax3.grid(True, alpha=0.3, linestyle='--')
     
     # 调整布局
-    plt.tight_layout()
+    fig.tight_layout()
     
     # 保存图片
-    output_path = os.path.join(exp_dir, 'sacrifice_dynamics.png')
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
+    fig.savefig(output_path, dpi=150, pil_kwargs=_PNG_SAVE_OPTIONS)
     print(f"Sacrifice dynamics saved to: {output_path}")
-    plt.close(fig)
+    _release_figure(fig)
     
-    # 保存分布数据到CSV（宽格式矩阵）
-    if not prob_matrix.empty:
-        dist_csv_path = os.path.join(exp_dir, 'sacrifice_distribution.csv')
-        prob_matrix.to_csv(dist_csv_path, index=False)
-        print(f"Sacrifice distribution saved to: {dist_csv_path}")
+    # 保存分布数据（宽格式矩阵）
+    if len(cum_probs):
+        prob_matrix = pd.DataFrame(cum_probs, columns=[f'position_{pos}' for pos in range(num_positions)])
+        prob_matrix.insert(0, 'time', df_sacrifice['time'].to_numpy())
+        dist_path = _write_table(prob_matrix, os.path.join(exp_dir, 'sacrifice_distribution.csv'),
+                                 table_format)
+        print(f"Sacrifice distribution saved to: {dist_path}")
     
     # 如果有上下文数据，保存条件概率时间序列
-    if has_context and time_position_prob:
-        # 保存条件概率时间序列（宽格式：时间 x 位置）
-        cond_prob_csv_path = os.path.join(exp_dir, 'sacrifice_conditional_prob_timeline.csv')
-        
-        # 获取所有位置
-        all_positions_for_csv = sorted(set(
-            pos for time_dict in time_position_prob.values() 
-            for pos in time_dict.keys()
-        ))
+    if has_context and not cond_prob.empty:
+        # 保存条件概率时间序列（宽格式：时间 x 位置），该时间该位置无事件则为0
+        cond_prob_table = cond_prob.fillna(0.0).rename(columns=lambda pos: f'position_{pos}') \
+            .rename_axis(index='time', columns=None).reset_index()
+        cond_prob_path = _write_table(
+            cond_prob_table, os.path.join(exp_dir, 'sacrifice_conditional_prob_timeline.csv'),
+            table_format)
         
-        # 创建宽格式数据
-        cond_prob_rows = []
-        for t in sorted(time_position_prob.keys()):
-            row = {'time': t}
-            for pos in all_positions_for_csv:
-                col_name = f'position_{pos}'
-                # 如果该时间该位置有概率，使用它；否则为0
-                row[col_name] = time_position_prob[t].get(pos, 0.0)
-            cond_prob_rows.append(row)
-        
-        # 写入CSV
-        if cond_prob_rows:
-            fieldnames = ['time'] + [f'position_{pos}' for pos in all_positions_for_csv]
-            
-            import csv
-            with open(cond_prob_csv_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(cond_prob_rows)
-            
-            print(f"Conditional probability timeline saved to: {cond_prob_csv_path}")
+        print(f"Conditional probability timeline saved to: {cond_prob_path}")
 
 
+@matplotlib.rc_context(_RC_PARAMS)
 def plot_performance_metrics(exp_dir: str, mode: str = None, 
                             truncation_info: dict = None,
                             state_save_batches: list = None,
-                            admission_control: dict = None):
+                            admission_control: dict = None,
+                            df_batch: pd.DataFrame = None,
+                            df_requests: pd.DataFrame = None,
+                            force: bool = False):
     """
     绘制性能指标图：平均解码吞吐量和平均延迟
     
@@ -996,65 +1409,72 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
         truncation_info: 截断信息字典
         state_save_batches: 标记批次列表
         admission_control: 准入控制配置
+        df_batch: 已读取的batch_snapshots.csv数据（可选，为None时从exp_dir读取）
+        df_requests: 已读取的request_traces.csv数据（可选，为None时从exp_dir读取）
+        force: 为False且未传入影响图像的参数（mode、truncation_info、state_save_batches、
+               admission_control）时，若performance_metrics.png比输入CSV都新则跳过绘制
     """
-    import csv
-    
     # 读取request_traces.csv
     request_traces_csv = os.path.join(exp_dir, 'request_traces.csv')
-    if not os.path.exists(request_traces_csv):
+    if df_requests is None and not os.path.exists(request_traces_csv):
         print("No request_traces.csv found, skipping performance metrics plot")
         return
     
     # 读取batch_snapshots.csv获取时间信息（用于标记线）
     batch_csv = os.path.join(exp_dir, 'batch_snapshots.csv')
-    df_batch = pd.read_csv(batch_csv) if os.path.exists(batch_csv) else None
+    output_path = os.path.join(exp_dir, 'performance_metrics.png')
+    figure_args = (mode, truncation_info, state_save_batches, admission_control)
+    if not force and all(arg is None for arg in figure_args) \
+            and _is_up_to_date(output_path, request_traces_csv, batch_csv):
+        print(f"Performance metrics up to date, skipping: {output_path}")
+        return
+    
+    if df_batch is None and os.path.exists(batch_csv):
+        df_batch = _read_csv(batch_csv, _BATCH_DTYPES)
     
     # 读取请求数据
-    df_requests = pd.read_csv(request_traces_csv)
+    if df_requests is None:
+        df_requests = _read_csv(request_traces_csv, _REQUEST_DTYPES)
     
-    # 过滤出已完成的请求（completion_time不为NaN）
-    df_completed = df_requests[df_requests['completion_time'].notna()].copy()
+    # 按completion_time排序一次；未完成的请求（NaN）排在末尾，截掉即可，不需要notna掩码和DataFrame副本
+    completion_times = df_requests['completion_time'].to_numpy(dtype=float)
+    order = np.argsort(completion_times, kind='stable')
+    num_completed = np.searchsorted(completion_times[order], np.inf, side='right')
+    order = order[:num_completed]
     
-    if df_completed.empty:
+    if num_completed == 0:
         print("No completed requests found, skipping performance metrics plot")
         return
     
-    # 按completion_time排序（应该已经排序了，但确保一下）
-    df_completed = df_completed.sort_values('completion_time')
+    # 计算累积指标：对排序后的请求做一次cumsum，
+    # 同一时刻完成的多个请求取该时刻最后一行（即包含该时刻所有请求的累积值）
+    sorted_times = completion_times[order]
+    cumulative_decode_length = np.cumsum(df_requests['decode_length'].to_numpy()[order])
+    cumulative_total_delay = np.cumsum(df_requests['total_delay'].to_numpy(dtype=float)[order])
+    last_in_group = np.append(np.flatnonzero(np.diff(sorted_times)), num_completed - 1)
     
-    # 计算累积指标
-    times = []
-    avg_throughputs = []
-    avg_latencies = []
+    # 计算平均值（只保留completion_time > 0的时刻）
+    last_in_group = last_in_group[sorted_times[last_in_group] > 0]
+    times = sorted_times[last_in_group]
+    avg_throughputs = cumulative_decode_length[last_in_group] / times
+    avg_latencies = cumulative_total_delay[last_in_group] / (last_in_group + 1)
     
-    # 按completion_time分组，处理同一时刻完成的多个请求
-    grouped = df_completed.groupby('completion_time')
-    
-    cumulative_decode_length = 0
-    cumulative_total_delay = 0
-    cumulative_count = 0
-    
-    for completion_time, group in grouped:
-        # 累加该时刻完成的所有请求
-        cumulative_decode_length += group['decode_length'].sum()
-        cumulative_total_delay += group['total_delay'].sum()
-        cumulative_count += len(group)
-        
-        # 计算平均值
-        if completion_time > 0:
-            avg_throughput = cumulative_decode_length / completion_time
-            avg_latency = cumulative_total_delay / cumulative_count
-            
-            times.append(completion_time)
-            avg_throughputs.append(avg_throughput)
-            avg_latencies.append(avg_latency)
-    
-    if not times:
+    if not len(times):
         print("No valid data points for performance metrics")
         return
     
+    # 标记批次对应的时间（两个子图共用）
+    state_save_info = (_batch_times(df_batch, state_save_batches)
+                       if state_save_batches and df_batch is not None else [])
+    
+    # 到达结束和仿真结束时间（两个子图共用，整列归约只算一次）
+    arrival_end_time = (df_requests['arrival_time'].max()
+                        if not df_requests.empty else None)
+    sim_end_time = (df_batch['time'].max()
+                    if df_batch is not None and not df_batch.empty else None)
+    
     # 创建2x1子图
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 12))
+    fig, (ax1, ax2) = _get_figure(2, (14, 12))
     
     # 添加标题
     title_lines = []
@@ -1076,9 +1496,9 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
     
     # 统计信息
     overall_stats = []
-    overall_stats.append(f"Total Completed: {cumulative_count}")
-    overall_stats.append(f"Total Decode Tokens: {cumulative_decode_length}")
-    if times:
+    overall_stats.append(f"Total Completed: {num_completed}")
+    overall_stats.append(f"Total Decode Tokens: {int(cumulative_decode_length[-1])}")
+    if len(times):
         final_throughput = avg_throughputs[-1]
         final_latency = avg_latencies[-1]
         overall_stats.append(f"Final Avg Throughput: {final_throughput:.2f} tokens/time")
@@ -1093,18 +1513,15 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
                     bbox=dict(boxstyle="round,pad=0.5", facecolor="lightgray", alpha=0.3))
     
     # ========== 第一个子图：平均解码吞吐量 ==========
-    ax1.plot(times, avg_throughputs,
-            label='Average Decode Throughput',
-            color='blue', linewidth=2, marker='o', markersize=2, alpha=0.8)
+    _plot_series(ax1, times, avg_throughputs,
+                 label='Average Decode Throughput',
+                 color='blue', linewidth=2, marker='o', markersize=2, alpha=0.8)
     
     # 添加标记线（如果有）
     if state_save_batches and df_batch is not None and not df_batch.empty:
-        for batch_id in state_save_batches:
-            batch_rows = df_batch[df_batch['batch_id'] == batch_id]
-            if not batch_rows.empty:
-                save_time = batch_rows['time'].iloc[0]
-                ax1.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
-                           alpha=0.6)
+        for _, save_time in state_save_info:
+            ax1.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
+                       alpha=0.6)
         
         # 添加图例标记
         if state_save_batches:
@@ -1116,14 +1533,12 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
                     alpha=0.6, label=label)
     
     # 添加arrival_end标记线（如果有）
-    if df_requests is not None and not df_requests.empty:
-        arrival_end_time = df_requests['arrival_time'].max()
+    if arrival_end_time is not None:
         ax1.axvline(x=arrival_end_time, color='black', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Arrival End ({arrival_end_time:.1f})')
     
     # 添加仿真结束时间的标记线（绿色）
-    if df_batch is not None and not df_batch.empty:
-        sim_end_time = df_batch['time'].max()
+    if sim_end_time is not None:
         ax1.axvline(x=sim_end_time, color='green', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Simulation End ({sim_end_time:.1f})')
     
@@ -1135,18 +1550,15 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
     ax1.set_ylim(bottom=0)
     
     # ========== 第二个子图：平均延迟 ==========
-    ax2.plot(times, avg_latencies,
-            label='Average Latency',
-            color='orange', linewidth=2, marker='s', markersize=2, alpha=0.8)
+    _plot_series(ax2, times, avg_latencies,
+                 label='Average Latency',
+                 color='orange', linewidth=2, marker='s', markersize=2, alpha=0.8)
     
     # 添加标记线（如果有）
     if state_save_batches and df_batch is not None and not df_batch.empty:
-        for batch_id in state_save_batches:
-            batch_rows = df_batch[df_batch['batch_id'] == batch_id]
-            if not batch_rows.empty:
-                save_time = batch_rows['time'].iloc[0]
-                ax2.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
-                           alpha=0.6)
+        for _, save_time in state_save_info:
+            ax2.axvline(x=save_time, color='red', linestyle='--', linewidth=1.5,
+                       alpha=0.6)
         
         # 添加图例标记
         if state_save_batches:
@@ -1158,14 +1570,12 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
                     alpha=0.6, label=label)
     
     # 添加arrival_end标记线（如果有）
-    if df_requests is not None and not df_requests.empty:
-        arrival_end_time = df_requests['arrival_time'].max()
+    if arrival_end_time is not None:
         ax2.axvline(x=arrival_end_time, color='black', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Arrival End ({arrival_end_time:.1f})')
     
     # 添加仿真结束时间的标记线（绿色）
-    if df_batch is not None and not df_batch.empty:
-        sim_end_time = df_batch['time'].max()
+    if sim_end_time is not None:
         ax2.axvline(x=sim_end_time, color='green', linestyle='--', linewidth=2,
                    alpha=0.7, label=f'Simulation End ({sim_end_time:.1f})')
     
@@ -1177,13 +1587,49 @@ def plot_performance_metrics(exp_dir: str, mode: str = None,
     ax2.set_ylim(bottom=0)
     
     # 调整布局
-    plt.tight_layout(rect=[0, 0, 1, 0.96])
+    fig.tight_layout(rect=[0, 0, 1, 0.96])
     
     # 保存图片
-    output_path = os.path.join(exp_dir, 'performance_metrics.png')
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
+    fig.savefig(output_path, dpi=150, pil_kwargs=_PNG_SAVE_OPTIONS)
     print(f"Performance metrics saved to: {output_path}")
-    plt.close(fig)
+    _release_figure(fig)
+
+
+def render_experiment(experiment: tuple):
+    """
+    进程池的工作函数：绘制单个实验的全部图表
+    
+    定义在模块顶层以便被pickle传给子进程；Figure不经过pyplot（见_get_figure），
+    各进程之间不共享任何绘图全局状态
+    
+    Args:
+        experiment: (csv_path, kwargs)元组，kwargs为传给plot_queue_dynamics的参数
+    """
+    csv_path, kwargs = experiment
+    plot_queue_dynamics(csv_path, **kwargs)
+
+
+def plot_many(csv_paths: list, max_workers: int = None, **kwargs):
+    """
+    并行绘制多个实验的图表，每个实验由一个工作进程处理
+    
+    Args:
+        csv_paths: batch_snapshots.csv文件路径列表；元素也可以是(csv_path, kwargs)元组，
+                   为该实验单独指定参数（覆盖共用参数）
+        max_workers: 最大进程数（默认为CPU核数）
+        kwargs: 传给plot_queue_dynamics的其他参数（所有实验共用）
+    """
+    experiments = []
+    for item in csv_paths:
+        if isinstance(item, str):
+            experiments.append((item, kwargs))
+        else:
+            csv_path, exp_kwargs = item
+            experiments.append((csv_path, {**kwargs, **exp_kwargs}))
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # 取出全部结果，使子进程中的异常在这里抛出
+        list(executor.map(render_experiment, experiments))
 
 
 def main():
@@ -1197,8 +1643,10 @@ def main():
     parser.add_argument(
         '--csv', 
         type=str, 
+        nargs='+',
         required=True,
-        help='Path to batch_snapshots.csv file (e.g., /path/to/experiment/batch_snapshots.csv)'
+        help='Path(s) to batch_snapshots.csv file (e.g., /path/to/experiment/batch_snapshots.csv); '
+             'multiple files are plotted in parallel'
     )
     parser.add_argument(
         '--arrival_end',
@@ -1206,20 +1654,37 @@ def main():
         default=None,
         help='Time when request arrivals end (optional, adds vertical line marker)'
     )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-plot even if the existing figures are newer than the CSV files'
+    )
+    parser.add_argument(
+        '--table-format',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='File format of the sacrifice distribution tables (parquet requires pyarrow)'
+    )
     
     args = parser.parse_args()
     
-    # Validate file exists
-    if not os.path.isfile(args.csv):
-        print(f"Error: File {args.csv} does not exist")
-        return
+    # Validate files exist
+    for csv_path in args.csv:
+        if not os.path.isfile(csv_path):
+            print(f"Error: File {csv_path} does not exist")
+            return
     
-    print(f"Processing CSV file: {args.csv}")
+    print(f"Processing CSV file(s): {', '.join(args.csv)}")
     if args.arrival_end is not None:
         print(f"Marking arrival end time at: {args.arrival_end}")
     
     # Plot queue dynamics (without M_total and B_total when called from command line)
-    plot_queue_dynamics(args.csv, args.arrival_end)
+    if len(args.csv) == 1:
+        plot_queue_dynamics(args.csv[0], args.arrival_end, force=args.force,
+                            table_format=args.table_format)
+    else:
+        plot_many(args.csv, arrival_end=args.arrival_end, force=args.force,
+                  table_format=args.table_format)
 
 
 if __name__ == "__main__":
@@ -1,60 +1,167 @@
 """
 系统动态可视化
 """
+import functools
+import gc
+import os
+import sys
 import pandas as pd
+import matplotlib
+# Headless Linux (no DISPLAY): select Agg before pyplot is imported so no GUI toolkit
+# gets probed or loaded; an explicit MPLBACKEND always takes precedence
+if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') \
+        and not os.environ.get('MPLBACKEND'):
+    matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
 import numpy as np
-import os
-import glob
 from pathlib import Path
 
+try:
+    import pyarrow  # noqa: F401  only used to enable pandas' multithreaded CSV engine
+    _CSV_ENGINE = 'pyarrow'
+except ImportError:
+    _CSV_ENGINE = 'c'
+
+# Columns actually plotted from each CSV and their types (other columns are not parsed)
+_SNAP_DTYPES = {
+    'time': 'float64', 'waiting_count': 'int32', 'running_count': 'int32',
+    'swapped_count': 'int32', 'gpu_memory_used': 'int32', 'memory_utilization': 'float32',
+    'batch_duration': 'float32', 'completed_count': 'int32',
+}
+_TRACE_DTYPES = {
+    'req_id': 'int64', 'arrival_time': 'float64', 'completion_time': 'float64',
+    'waiting_time': 'float64', 'execution_time': 'float64', 'swap_count': 'int32',
+}
+
 
+@functools.lru_cache(maxsize=8)
 def find_latest_experiment(base_dir: str = "data/experiments") -> str:
     """
     Find the latest experiment directory
     
+    The result is cached per base_dir for the lifetime of the process, so plotting
+    several figures for the latest experiment scans the directory only once
+    (call find_latest_experiment.cache_clear() to pick up newly created experiments)
+    
     Args:
         base_dir: Base directory containing experiments
         
     Returns:
         Path to latest experiment directory
     """
-    pattern = os.path.join(base_dir, "experiment_*")
-    exp_dirs = glob.glob(pattern)
+    # One scandir pass: DirEntry caches the stat result, so each entry is stat'ed once
+    candidates = []
+    if os.path.isdir(base_dir):
+        with os.scandir(base_dir) as entries:
+            candidates = [(entry.stat().st_mtime, entry.path) for entry in entries
+                          if entry.name.startswith("experiment_") and entry.is_dir()]
     
-    if not exp_dirs:
+    if not candidates:
         # Fallback to old output directory
         if os.path.exists("data/output"):
             return "data/output"
         raise ValueError(f"No experiment directories found in {base_dir}")
     
-    # Sort by modification time
-    latest = max(exp_dirs, key=os.path.getmtime)
-    return latest
+    # Latest by modification time
+    return max(candidates)[1]
+
+
+def _decimate(x: np.ndarray, y: np.ndarray, n_target: int = 2000):
+    """
+    Downsample a series to about n_target points for plotting
+    
+    The series is split into n_target/2 equal buckets and the minimum and maximum
+    of each bucket are kept, so spikes survive (plain striding would drop them).
+    
+    Args:
+        x: X values
+        y: Y values
+        n_target: Approximate number of points to keep (first and last are always kept)
+        
+    Returns:
+        (x, y) tuple, unchanged if already short enough
+    """
+    n = len(x)
+    if n <= n_target:
+        return x, y
+    n_buckets = n_target // 2
+    bucket_size = -(-n // n_buckets)
+    # 末尾用最后一个值补齐，使序列能整形为(桶数, 桶大小)
+    padded = np.concatenate([y, np.full(n_buckets * bucket_size - n, y[-1])])
+    buckets = padded.reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    idx = np.concatenate([[0, n - 1], offsets + buckets.argmin(axis=1),
+                          offsets + buckets.argmax(axis=1)])
+    idx = np.unique(np.minimum(idx, n - 1))
+    return x[idx], y[idx]
+
+
+def _barh_collection(left: np.ndarray, width: np.ndarray, y: np.ndarray,
+                     color: str, label: str, height: float = 0.8) -> PolyCollection:
+    """
+    Build all horizontal bars as one PolyCollection (same geometry as ax.barh)
+    
+    Args:
+        left: Bar start times
+        width: Bar lengths
+        y: Bar centers on the y axis
+        color: Fill color
+        label: Legend label
+        height: Bar height
+        
+    Returns:
+        PolyCollection with one rectangle per bar
+    """
+    bottom = y - height / 2
+    top = y + height / 2
+    right = left + width
+    vertices = np.stack([
+        np.column_stack([left, bottom]),
+        np.column_stack([left, top]),
+        np.column_stack([right, top]),
+        np.column_stack([right, bottom]),
+    ], axis=1)
+    collection = PolyCollection(vertices, facecolors=color, edgecolors='none',
+                                alpha=0.6, label=label, rasterized=True)
+    # Like barh, keep autoscale margins from extending past the bar start edges
+    collection.sticky_edges.x.extend(left.tolist())
+    return collection
 
 
-def plot_system_dynamics(output_dir: str = None):
+def plot_system_dynamics(output_dir: str = None, show: bool = True):
     """
     Plot system dynamics
     
     Args:
         output_dir: Output directory (if None, use latest experiment)
+        show: Open the figure window after saving (disable for batch runs)
     """
     if output_dir is None:
         output_dir = find_latest_experiment()
         print(f"Using experiment directory: {output_dir}")
     # 读取数据
-    snapshots = pd.read_csv(f"{output_dir}/batch_snapshots.csv")
+    snapshots = pd.read_csv(f"{output_dir}/batch_snapshots.csv",
+                            usecols=list(_SNAP_DTYPES), dtype=_SNAP_DTYPES, engine=_CSV_ENGINE)
+    
+    # 各列只转换一次为NumPy数组，之后绘图和计算都直接使用数组
+    arrays = {col: snapshots[col].to_numpy() for col in _SNAP_DTYPES}
+    time = arrays['time']
+    
+    # 绘图只需要约2000个点（图宽1800像素），长仿真先抽样；统计量仍基于完整数据
+    def series(col):
+        return _decimate(time, arrays[col])
     
     # 创建图形
-    fig, axes = plt.subplots(3, 2, figsize=(12, 10))
+    # constrained_layout在绘制时一次完成布局，代替tight_layout的额外迭代
+    fig, axes = plt.subplots(3, 2, figsize=(12, 10), constrained_layout=True)
     fig.suptitle('LLM Service System Dynamics Simulation', fontsize=14, fontweight='bold')
     
     # 1. 队列长度
     ax = axes[0, 0]
-    ax.plot(snapshots['time'], snapshots['waiting_count'], label='Waiting', color='blue')
-    ax.plot(snapshots['time'], snapshots['running_count'], label='Running', color='green')
-    ax.plot(snapshots['time'], snapshots['swapped_count'], label='Swapped', color='orange')
+    ax.plot(*series('waiting_count'), label='Waiting', color='blue', rasterized=True)
+    ax.plot(*series('running_count'), label='Running', color='green', rasterized=True)
+    ax.plot(*series('swapped_count'), label='Swapped', color='orange', rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Number of Requests')
     ax.set_title('Queue States')
@@ -63,9 +170,10 @@ def plot_system_dynamics(output_dir: str = None):
     
     # 2. 内存使用
     ax = axes[0, 1]
-    ax.plot(snapshots['time'], snapshots['gpu_memory_used'], label='GPU Memory Used', color='red')
+    memory_time, memory_used = series('gpu_memory_used')
+    ax.plot(memory_time, memory_used, label='GPU Memory Used', color='red', rasterized=True)
     ax.axhline(y=10000, color='black', linestyle='--', label='Memory Limit')
-    ax.fill_between(snapshots['time'], 0, snapshots['gpu_memory_used'], alpha=0.3, color='red')
+    ax.fill_between(memory_time, 0, memory_used, alpha=0.3, color='red', rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Tokens')
     ax.set_title('GPU Memory Usage')
@@ -74,7 +182,8 @@ def plot_system_dynamics(output_dir: str = None):
     
     # 3. 内存利用率
     ax = axes[1, 0]
-    ax.plot(snapshots['time'], snapshots['memory_utilization'] * 100, color='purple')
+    util_time, utilization = series('memory_utilization')
+    ax.plot(util_time, utilization * 100, color='purple', rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Utilization (%)')
     ax.set_title('Memory Utilization')
@@ -82,7 +191,7 @@ def plot_system_dynamics(output_dir: str = None):
     
     # 4. 批次执行时间
     ax = axes[1, 1]
-    ax.plot(snapshots['time'], snapshots['batch_duration'], color='brown')
+    ax.plot(*series('batch_duration'), color='brown', rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Duration')
     ax.set_title('Batch Execution Time')
@@ -90,7 +199,7 @@ def plot_system_dynamics(output_dir: str = None):
     
     # 5. 累计完成数
     ax = axes[2, 0]
-    ax.plot(snapshots['time'], snapshots['completed_count'], color='green', linewidth=2)
+    ax.plot(*series('completed_count'), color='green', linewidth=2, rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Completed Requests')
     ax.set_title('Cumulative Completions')
@@ -98,78 +207,94 @@ def plot_system_dynamics(output_dir: str = None):
     
     # 6. 吞吐量（移动平均）
     ax = axes[2, 1]
-    window = min(20, len(snapshots) // 4)
+    window = min(20, len(time) // 4)
     if window > 1:
-        throughput = snapshots['completed_count'].diff() / snapshots['time'].diff()
-        throughput_ma = throughput.rolling(window=window).mean()
-        ax.plot(snapshots['time'], throughput_ma, color='teal')
+        # 每批吞吐量 = Δcompleted / Δtime；对其做window个批次的滑动平均，
+        # 直接在NumPy数组上用一次卷积完成（前window个点没有完整窗口，为NaN）
+        throughput = np.diff(arrays['completed_count'].astype(float)) / np.diff(time)
+        throughput_ma = np.full(len(time), np.nan)
+        throughput_ma[window:] = np.convolve(throughput, np.ones(window) / window, mode='valid')
+        ax.plot(*_decimate(time, throughput_ma), color='teal', rasterized=True)
     ax.set_xlabel('Time')
     ax.set_ylabel('Requests/Time Unit')
     ax.set_title(f'Throughput ({window}-batch Moving Average)')
     ax.grid(True, alpha=0.3)
     
-    plt.tight_layout()
-    
     # 保存图片
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     plt.savefig(output_path / 'system_dynamics.png', dpi=150, bbox_inches='tight')
     print(f"System dynamics plot saved to: {output_path / 'system_dynamics.png'}")
     
-    plt.show()
+    if show:
+        plt.show()
+    # 立即释放Figure及其Axes/Line2D，避免连续绘图时旧图一直占用内存
+    plt.close(fig)
 
 
-def plot_request_timeline(output_dir: str = None, sample_size: int = 20):
+def plot_request_timeline(output_dir: str = None, sample_size: int = 20, show: bool = True):
     """
     Plot request timeline
     
     Args:
         output_dir: Output directory (if None, use latest experiment)
         sample_size: Number of requests to sample
+        show: Open the figure window after saving (disable for batch runs)
     """
     if output_dir is None:
         output_dir = find_latest_experiment()
         print(f"Using experiment directory: {output_dir}")
     # 读取数据
-    traces = pd.read_csv(f"{output_dir}/request_traces.csv")
+    traces = pd.read_csv(f"{output_dir}/request_traces.csv",
+                         usecols=list(_TRACE_DTYPES), dtype=_TRACE_DTYPES, engine=_CSV_ENGINE)
     
-    # 采样请求
+    # 采样请求：直接抽取行号再取行，只对抽到的少量行按req_id排序
+    # （轨迹文件不一定按req_id有序）
     if len(traces) > sample_size:
-        sampled = traces.sample(n=sample_size, random_state=42).sort_values('req_id')
+        rng = np.random.default_rng(42)
+        idx = rng.choice(len(traces), size=sample_size, replace=False)
+        sampled = traces.iloc[idx].sort_values('req_id')
     else:
         sampled = traces
     
     # 创建图形
     fig, ax = plt.subplots(figsize=(12, 8))
     
-    # 绘制每个请求的时间线
-    for idx, row in sampled.iterrows():
-        req_id = row['req_id']
-        y_pos = req_id
-        
-        # 等待时间（蓝色）
-        if pd.notna(row['waiting_time']) and row['waiting_time'] > 0:
-            ax.barh(y_pos, row['waiting_time'], 
-                   left=row['arrival_time'], height=0.8,
-                   color='blue', alpha=0.6)
-        
-        # 执行时间（绿色）
-        if pd.notna(row['execution_time']) and pd.notna(row['completion_time']):
-            exec_start = row['arrival_time'] + (row['waiting_time'] if pd.notna(row['waiting_time']) else 0)
-            ax.barh(y_pos, row['execution_time'],
-                   left=exec_start, height=0.8,
-                   color='green', alpha=0.6)
-        
-        # 标记swap次数
-        if row['swap_count'] > 0:
-            ax.text(row['completion_time'] if pd.notna(row['completion_time']) else row['arrival_time'],
-                   y_pos, f" S:{int(row['swap_count'])}", 
-                   va='center', fontsize=8, color='red')
+    # 绘制每个请求的时间线：所有请求的等待段、执行段各合并为一个PolyCollection
+    # （逐个barh会为每个请求创建一个Rectangle并触发一次自动缩放）
+    y_pos = sampled['req_id'].to_numpy(dtype=float)
+    arrival = sampled['arrival_time'].to_numpy(dtype=float)
+    waiting = sampled['waiting_time'].to_numpy(dtype=float)
+    execution = sampled['execution_time'].to_numpy(dtype=float)
+    completion = sampled['completion_time'].to_numpy(dtype=float)
+    exec_start = arrival + np.nan_to_num(waiting)
+    
+    # 等待时间（蓝色）；空集合会把原点计入坐标范围，因此没有数据时不添加
+    has_wait = waiting > 0
+    if has_wait.any():
+        ax.add_collection(_barh_collection(
+            arrival[has_wait], waiting[has_wait], y_pos[has_wait],
+            color='blue', label='Waiting Time'))
+    
+    # 执行时间（绿色）
+    has_exec = ~np.isnan(execution) & ~np.isnan(completion)
+    if has_exec.any():
+        ax.add_collection(_barh_collection(
+            exec_start[has_exec], execution[has_exec], y_pos[has_exec],
+            color='green', label='Execution Time'))
+    ax.autoscale_view()
+    
+    # 标记swap次数（只遍历有swap的请求）
+    swap_count = sampled['swap_count'].to_numpy()
+    label_x = np.where(np.isnan(completion), arrival, completion)
+    has_swap = swap_count > 0
+    for x, y, count in zip(label_x[has_swap], y_pos[has_swap], swap_count[has_swap]):
+        ax.text(x, y, f" S:{int(count)}", va='center', fontsize=8, color='red')
     
     ax.set_xlabel('Time')
     ax.set_ylabel('Request ID')
     ax.set_title(f'Request Timeline (Sample of {len(sampled)} requests)')
-    ax.legend(['Waiting Time', 'Execution Time'], loc='upper right')
+    ax.legend(loc='upper right')
     ax.grid(True, alpha=0.3)
     
     plt.tight_layout()
@@ -179,7 +304,10 @@ def plot_request_timeline(output_dir: str = None, sample_size: int = 20):
     plt.savefig(output_path / 'request_timeline.png', dpi=150, bbox_inches='tight')
     print(f"Request timeline saved to: {output_path / 'request_timeline.png'}")
     
-    plt.show()
+    if show:
+        plt.show()
+    # 立即释放Figure及其Axes/Line2D，避免连续绘图时旧图一直占用内存
+    plt.close(fig)
 
 
 if __name__ == "__main__":
@@ -192,11 +320,14 @@ if __name__ == "__main__":
                        help="Output directory (deprecated, use --experiment-dir)")
     parser.add_argument("--sample_size", type=int, default=20,
                        help="Request timeline sample size")
+    parser.add_argument("--no-show", action="store_true",
+                       help="Only save the figures, do not open plot windows")
     
     args = parser.parse_args()
     
     # Handle backward compatibility
     exp_dir = args.experiment_dir or args.output_dir
     
-    plot_system_dynamics(exp_dir)
-    plot_request_timeline(exp_dir, args.sample_size)
\ No newline at end of file
+    plot_system_dynamics(exp_dir, show=not args.no_show)
+    gc.collect()
+    plot_request_timeline(exp_dir, args.sample_size, show=not args.no_show)
\ No newline at end of file